@@ -1,7 +1,7 @@
-from xor_helpers import generate_xor_slices, potential_match
+from xor_helpers import BOUNDARY, generate_xor_slices, potential_match
 
 
-def auto_crib_drag(words, xor_data, len_ct, num_ct, dict):
+def auto_crib_drag(words, xor_data, len_ct, num_ct, dict, offsets=None):
     """
     Automatically crib drags words over the XOR'd ciphertexts.
     There are three scenarios we could come across during this,
@@ -9,6 +9,10 @@ def auto_crib_drag(words, xor_data, len_ct, num_ct, dict):
         a. deciphers entire words in the plaintexts.
         b. deciphers portions of words in the plaintexts.
         c. yields complete gibberish.
+
+    If `offsets` is given as a (start, stop) pair, only crib positions in
+    that range are tried. This lets a distributed worker drag over a
+    window of the ciphertexts instead of the whole thing.
     """
 
     matches = []
@@ -22,11 +26,12 @@ def auto_crib_drag(words, xor_data, len_ct, num_ct, dict):
             continue
 
         max_offset = len_ct - crib_len + 1  # +1 since range is exclusive
+        start, stop = offsets if offsets else (0, max_offset)
 
         # # Debugging purposes
         # print(f"Crib dragging '{crib}' across {labels}")
 
-        for offset in range(max_offset):
+        for offset in range(start, min(stop, max_offset)):
             xor_slices = generate_xor_slices(xor_data, offset, crib_len)
             matches_found = potential_match(
                 xor_slices, crib, offset, dict)
@@ -36,3 +41,28 @@ def auto_crib_drag(words, xor_data, len_ct, num_ct, dict):
     # print("Finished looking for potential matches!")
     # print(f"Found {len(matches)} potential matches!")
     return matches, cribs
+
+
+def refine_matches(all_matches, crib_matches):
+    """
+    Keeps only the matches whose decrypted substrings all appear in some
+    other crib that matched, since a real plaintext word should also have
+    been found when dragged on its own.
+    """
+    refined_matches = []
+    for match in all_matches:
+        keep = True
+        for substrings in match["substrings"]:
+            all_present = all(
+                any(substring.rstrip(BOUNDARY) in crib for crib in crib_matches)
+                for substring in substrings
+            )
+            if not all_present:
+                if match["crib"] == b"shouldn't":
+                    print(f"Refinement failed for the crib {match['crib']}")
+                    print(substrings)
+                keep = False
+                break
+        if keep:
+            refined_matches.append(match)
+    return refined_matches
@@ -0,0 +1,342 @@
+from utils import construct_dict, read_ciphertexts
+from xor_helpers import generate_xor_data
+from decrypt import auto_crib_drag, refine_matches
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import (Client, Connection, answer_challenge,
+                                        deliver_challenge)
+from collections import deque
+from pprint import pprint
+import argparse
+import os
+import socket
+import threading
+import time
+
+TIERS = ["10", "20", "35", "50", "70", "95"]
+
+
+def build_leases(words, tiers, len_ct, crib_chunk, offset_chunk):
+    """
+    Splits the crib search into leases a worker can run on its own.
+    Each lease is a (tier, crib range, offset range) triple, stored as:
+      {"id": 0, "tier": "70", "words": [...], "offsets": (0, 32)}
+
+    :param words: The list of word sets returned by `construct_dict`.
+    :param tiers: The tiers to search, e.g. ["10", "20", "35"].
+    :param len_ct: The length of the ciphertexts.
+    :param crib_chunk: The number of cribs in each lease.
+    :param offset_chunk: The number of offsets in each lease.
+    :return: A list of leases.
+    """
+    leases = []
+    for tier in tiers:
+        tier_words = sorted(words[TIERS.index(tier)])
+        for i in range(0, len(tier_words), crib_chunk):
+            for start in range(0, len_ct, offset_chunk):
+                leases.append({
+                    "id": len(leases),
+                    "tier": tier,
+                    "words": tier_words[i:i + crib_chunk],
+                    "offsets": (start, min(start + offset_chunk, len_ct))
+                })
+    return leases
+
+
+class Coordinator:
+    """
+    Hands leases out to workers over TCP and collects their matches.
+
+    Every connected worker loops on the following messages:
+      ("lease",)                           -> ("lease", lease), ("wait", s) or ("done",)
+      ("result", lease_id, matches, cribs) -> ("ack",)
+      ("error", lease_id, error)           -> ("ack",)
+    A lease that is not returned within `lease_timeout` seconds, whose
+    worker disconnects, or that raises an error is handed out again. After
+    `max_attempts` tries it is marked failed so one bad lease cannot stall
+    the search. Only the first result for a lease is kept, and once `run`
+    returns every further result or error is ignored.
+    """
+
+    def __init__(self, address, authkey, leases, setup, lease_timeout=300,
+                 max_attempts=3):
+        self.listener = socket.create_server(address)
+        self.authkey = authkey
+        self.setup = setup
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.leases = {lease["id"]: lease for lease in leases}
+        self.pending = deque(self.leases)
+        self.active = {}  # lease id -> (deadline, leases held by the worker)
+        self.attempts = {lease_id: 0 for lease_id in self.leases}
+        self.completed = set()
+        self.failed = set()
+        self.matches = []
+        self.cribs = set()
+        self.finished = False
+        self.cond = threading.Condition()
+
+    def _requeue(self, lease_id, reason):
+        del self.active[lease_id]
+        if self.attempts[lease_id] >= self.max_attempts:
+            print(f"Lease {lease_id} {reason} on attempt "
+                  f"{self.attempts[lease_id]}, giving up on it.")
+            self.failed.add(lease_id)
+            self.cond.notify_all()
+        else:
+            print(f"Lease {lease_id} {reason}, re-issuing it.")
+            self.pending.append(lease_id)
+
+    def _reclaim_expired(self):
+        now = time.monotonic()
+        for lease_id, (deadline, _) in list(self.active.items()):
+            if deadline <= now:
+                self._requeue(lease_id, "timed out")
+
+    def _next_lease(self, held):
+        with self.cond:
+            if self.finished:
+                return ("done",)
+            self._reclaim_expired()
+            if self.pending:
+                lease_id = self.pending.popleft()
+                deadline = time.monotonic() + self.lease_timeout
+                self.active[lease_id] = (deadline, held)
+                self.attempts[lease_id] += 1
+                held.add(lease_id)
+                return ("lease", self.leases[lease_id])
+            if self.active:
+                # Wait on the workers still running, one of them may die
+                return ("wait", 1)
+            return ("done",)
+
+    def _complete(self, lease_id, matches, cribs, held):
+        with self.cond:
+            held.discard(lease_id)
+            self.active.pop(lease_id, None)
+            if self.finished or lease_id in self.completed:
+                return
+            # A late result still counts even if we had given up on it
+            self.failed.discard(lease_id)
+            if lease_id in self.pending:
+                self.pending.remove(lease_id)
+            self.completed.add(lease_id)
+            self.matches += matches
+            self.cribs |= cribs
+            print(f"Finished {len(self.completed)}/{len(self.leases)} leases.")
+            self.cond.notify_all()
+
+    def _error(self, lease_id, error, held):
+        with self.cond:
+            held.discard(lease_id)
+            if self.finished:
+                return
+            print(f"Lease {lease_id} raised {error}")
+            if self.active.get(lease_id, (None, None))[1] is held:
+                self._requeue(lease_id, "raised an error")
+
+    def _release(self, held):
+        with self.cond:
+            for lease_id in held:
+                # The lease may already have been re-issued to someone else
+                if self.active.get(lease_id, (None, None))[1] is held:
+                    self._requeue(lease_id, "was lost by its worker")
+
+    def _serve(self, sock):
+        held = set()
+        conn = Connection(sock.detach())
+        try:
+            # The same handshake as Listener.accept, but run on this
+            # connection's own thread so a peer that never answers only
+            # holds itself up rather than every worker behind it
+            deliver_challenge(conn, self.authkey)
+            answer_challenge(conn, self.authkey)
+            conn.send(("setup", *self.setup))
+            while True:
+                message = conn.recv()
+                if message[0] == "lease":
+                    conn.send(self._next_lease(held))
+                elif message[0] == "result":
+                    _, lease_id, matches, cribs = message
+                    self._complete(lease_id, matches, cribs, held)
+                    conn.send(("ack",))
+                elif message[0] == "error":
+                    _, lease_id, error = message
+                    self._error(lease_id, error, held)
+                    conn.send(("ack",))
+        except (AuthenticationError, EOFError, OSError):
+            # Wrong authkey, or the worker hung up
+            pass
+        finally:
+            self._release(held)
+            conn.close()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                if self.finished:
+                    # run() closed the listener
+                    return
+                continue
+            sock.setblocking(True)
+            threading.Thread(target=self._serve, args=(sock,),
+                             daemon=True).start()
+
+    def run(self):
+        """
+        Serves leases until every one of them has a result or has failed.
+        Returns the merged matches and cribs, like `auto_crib_drag`, along
+        with the ids of the failed leases. Workers still connected are told
+        there is no work left.
+        """
+        threading.Thread(target=self._accept, daemon=True).start()
+        with self.cond:
+            while len(self.completed) + len(self.failed) < len(self.leases):
+                # Wake up periodically so expired leases are noticed
+                self.cond.wait(timeout=1)
+                self._reclaim_expired()
+            self.finished = True
+            result = (list(self.matches), set(self.cribs),
+                      frozenset(self.failed))
+        try:
+            # Wakes up the accept thread on Linux, close alone does not
+            self.listener.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.listener.close()
+        return result
+
+
+def run_coordinator(host, port, authkey, max_tier, crib_chunk, offset_chunk,
+                    lease_timeout, max_attempts, filename="ciphertexts.txt"):
+    """
+    Splits every tier up to and including `max_tier` into leases, waits for
+    workers to complete them and then runs the usual refinement step over
+    the merged matches.
+
+    Refinement checks each match against the cribs found in all of the
+    searched tiers. The common tiers are always searched so that short
+    words like "the" are in that pool, just as in `main.py`.
+    """
+    ciphertexts = read_ciphertexts(filename)
+    if len(ciphertexts) < 2:
+        print("Need at least two ciphertexts. Exiting.")
+        return
+
+    words = construct_dict()
+    len_ct = len(ciphertexts[-1])
+    xor_data = generate_xor_data(ciphertexts)
+
+    tiers = TIERS[:TIERS.index(max_tier) + 1]
+    leases = build_leases(words, tiers, len_ct, crib_chunk, offset_chunk)
+    setup = (xor_data, len_ct, len(ciphertexts))
+    coordinator = Coordinator((host, port), authkey, leases, setup,
+                              lease_timeout, max_attempts)
+
+    print(f"Serving {len(leases)} leases for tiers {tiers} on {host}:{port}")
+    start_time = time.perf_counter()
+    all_matches, crib_matches, failed = coordinator.run()
+    end_time = time.perf_counter()
+    print(f"Execution time: {end_time - start_time:.6f} seconds")
+
+    for lease_id in sorted(failed):
+        lease = coordinator.leases[lease_id]
+        print(f"Lease {lease_id} failed, tier {lease['tier']} cribs "
+              f"'{lease['words'][0]}' to '{lease['words'][-1]}' at offsets "
+              f"{lease['offsets']} were not searched.")
+
+    refined_matches = refine_matches(all_matches, crib_matches)
+
+    print(f"We have {len(refined_matches)} refined matches!")
+
+    refined_matches.sort(key=lambda x: x["length"], reverse=True)
+    pprint(refined_matches[:10])
+    return refined_matches
+
+
+def run_worker(host, port, authkey, retries=10):
+    """
+    Connects to a coordinator and runs `auto_crib_drag` on leases until
+    the coordinator reports that there is no work left.
+    """
+    for attempt in range(retries):
+        try:
+            conn = Client((host, port), authkey=authkey)
+            break
+        except (EOFError, OSError):
+            # The coordinator may still be loading the dictionary
+            time.sleep(1)
+    else:
+        print(f"No coordinator reachable on {host}:{port}, exiting.")
+        return
+
+    try:
+        _, xor_data, len_ct, num_ct = conn.recv()
+        dict = construct_dict()[-1]
+        while True:
+            conn.send(("lease",))
+            message = conn.recv()
+            if message[0] == "done":
+                break
+            if message[0] == "wait":
+                time.sleep(message[1])
+                continue
+            lease = message[1]
+            try:
+                matches, cribs = auto_crib_drag(
+                    lease["words"], xor_data, len_ct, num_ct, dict, lease["offsets"])
+            except Exception as e:
+                # Report it and move on, the coordinator decides on retries
+                print(f"Lease {lease['id']} raised {e!r}")
+                conn.send(("error", lease["id"], repr(e)))
+                conn.recv()
+                continue
+            conn.send(("result", lease["id"], matches, cribs))
+            conn.recv()
+    except (EOFError, OSError):
+        # Coordinator finished and closed the connection
+        pass
+    finally:
+        conn.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Distributed crib search over a TCP work queue.")
+    parser.add_argument("role", choices=["coordinator", "worker"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6000)
+    parser.add_argument("--authkey", default=os.environ.get("OTP_AUTHKEY"),
+                        help="Secret shared by the coordinator and workers, "
+                        "defaults to $OTP_AUTHKEY")
+    parser.add_argument("--max-tier", choices=TIERS, default="70",
+                        help="Search every tier up to and including this one, "
+                        "the default matches main.py")
+    parser.add_argument("--crib-chunk", type=int, default=500,
+                        help="Number of cribs in each lease")
+    parser.add_argument("--offset-chunk", type=int, default=64,
+                        help="Number of crib offsets in each lease")
+    parser.add_argument("--lease-timeout", type=float, default=300,
+                        help="Seconds before an unfinished lease is re-issued")
+    parser.add_argument("--max-attempts", type=int, default=3,
+                        help="Times a lease is handed out before it is failed")
+    parser.add_argument("--ciphertexts", default="ciphertexts.txt")
+    args = parser.parse_args()
+    # Connections exchange pickles, so the key is all that stops a peer
+    # from running code on this machine. There is deliberately no default.
+    if not args.authkey:
+        parser.error("an authkey is required, pass --authkey or set OTP_AUTHKEY")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    authkey = args.authkey.encode("utf-8")
+    if args.role == "coordinator":
+        run_coordinator(args.host, args.port, authkey, args.max_tier,
+                        args.crib_chunk, args.offset_chunk,
+                        args.lease_timeout, args.max_attempts,
+                        args.ciphertexts)
+    else:
+        run_worker(args.host, args.port, authkey)
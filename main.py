@@ -1,33 +1,20 @@
-from utils import load_words, read_ciphertexts, split_set
+from utils import construct_dict, read_ciphertexts, split_set
 from xor_helpers import xor
-from decrypt import auto_crib_drag
+from decrypt import auto_crib_drag, refine_matches
 from pprint import pprint
 import time
 import os
 import psutil  # type: ignore
 from multiprocessing import Pool
-import string
 
-# Lower the priority of the process
-p = psutil.Process(os.getpid())
-p.nice(psutil.IDLE_PRIORITY_CLASS)  # On Windows
 
-BOUNDARY = bytes(string.whitespace + string.punctuation, "utf-8")
-
-
-def construct_dict():
-    words = []
-
-    word_path = 'dictionary/english-words'
-    words.append(load_words(f'{word_path}.10', words))
-    words.append(load_words(f'{word_path}.20', words))
-    words.append(load_words(f'{word_path}.35', words))
-    words.append(load_words(f'{word_path}.50', words))
-    words.append(load_words(f'{word_path}.70', words))
-    words.append(load_words(f'{word_path}.95', words))
-    words.append(set().union(*words))
-
-    return words
+def lower_priority():
+    """ Lowers the priority of the process, the Pool workers inherit it. """
+    p = psutil.Process(os.getpid())
+    if hasattr(psutil, "IDLE_PRIORITY_CLASS"):
+        p.nice(psutil.IDLE_PRIORITY_CLASS)  # On Windows
+    else:
+        p.nice(19)  # On Linux
 
 
 def main():
@@ -38,6 +25,7 @@ def main():
       - Attempt automatic combination testing
       - Jump to the interactive approach at user request
     """
+    lower_priority()
     num_processes = os.cpu_count()
 
     filename = "ciphertexts.txt"
@@ -96,23 +84,7 @@ def main():
         end_time = time.perf_counter()
         print(f"Execution time: {end_time - start_time:.6f} seconds")
 
-    refined_matches = []
-    # refine matches
-    for match in all_matches:
-        keep = True
-        for substrings in match["substrings"]:
-            all_present = all(
-                any(substring.rstrip(BOUNDARY) in crib for crib in crib_matches)
-                for substring in substrings
-            )
-            if not all_present:
-                if match["crib"] == b"shouldn't":
-                    print(f"Refinement failed for the crib {match["crib"]}")
-                    print(substrings)
-                keep = False
-                break
-        if keep:
-            refined_matches.append(match)
+    refined_matches = refine_matches(all_matches, crib_matches)
 
     print(f"We have {len(refined_matches)} refined matches!")
 
@@ -0,0 +1,206 @@
+"""
+Localhost tests for the coordinator's lease handling in `distributed.py`.
+Workers are either `Client` connections driven by hand or `run_worker`
+threads with `auto_crib_drag` patched out, so the WordTrie binary is not
+needed. Run with `python -m unittest test_distributed`.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Client
+from unittest import mock
+import socket
+import threading
+import time
+import unittest
+
+import distributed
+
+AUTHKEY = b"test-key"
+
+
+def make_leases(n):
+    return [{"id": i, "tier": "10", "words": [f"word{i}"], "offsets": (0, 1)}
+            for i in range(n)]
+
+
+def match(lease_id):
+    return [{"crib": f"word{lease_id}".encode("utf-8"), "start": 0}]
+
+
+class CoordinatorTest(unittest.TestCase):
+
+    def start(self, leases, **kwargs):
+        """ Starts a coordinator on a free port and runs it on a thread. """
+        self.coordinator = distributed.Coordinator(
+            ("127.0.0.1", 0), AUTHKEY, leases, ({}, 1, 2), **kwargs)
+        self.port = self.coordinator.listener.getsockname()[1]
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(self.executor.shutdown, wait=False)
+        self.run_future = self.executor.submit(self.coordinator.run)
+
+    def result(self):
+        return self.run_future.result(timeout=10)
+
+    def connect(self):
+        conn = Client(("127.0.0.1", self.port), authkey=AUTHKEY)
+        self.addCleanup(conn.close)
+        self.assertEqual(conn.recv()[0], "setup")
+        return conn
+
+    def take(self, conn):
+        """ Asks for leases until one is handed out, returning its id. """
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            conn.send(("lease",))
+            message = conn.recv()
+            if message[0] == "lease":
+                return message[1]["id"]
+            self.assertEqual(message[0], "wait")
+            time.sleep(0.05)
+        self.fail("No lease was handed out")
+
+    def finish(self, conn, lease_id):
+        conn.send(("result", lease_id, match(lease_id),
+                   {f"word{lease_id}".encode("utf-8")}))
+        self.assertEqual(conn.recv(), ("ack",))
+
+    def test_normal_run(self):
+        self.start(make_leases(2))
+        first, second = self.connect(), self.connect()
+        self.finish(first, self.take(first))
+        self.finish(second, self.take(second))
+
+        matches, cribs, failed = self.result()
+        self.assertEqual(sorted(m["crib"] for m in matches),
+                         [b"word0", b"word1"])
+        self.assertEqual(cribs, {b"word0", b"word1"})
+        self.assertEqual(failed, frozenset())
+        self.assertEqual(self.coordinator.completed, {0, 1})
+
+        # Once finished, workers are told there is nothing left
+        first.send(("lease",))
+        self.assertEqual(first.recv(), ("done",))
+
+    def test_killed_worker(self):
+        self.start(make_leases(1))
+        dead = self.connect()
+        self.assertEqual(self.take(dead), 0)
+        dead.close()
+
+        survivor = self.connect()
+        self.assertEqual(self.take(survivor), 0)
+        self.finish(survivor, 0)
+
+        matches, _, failed = self.result()
+        self.assertEqual(matches, match(0))
+        self.assertEqual(failed, frozenset())
+        self.assertEqual(self.coordinator.attempts[0], 2)
+
+    def test_expired_lease_and_late_result(self):
+        self.start(make_leases(1), lease_timeout=0.3)
+        slow = self.connect()
+        self.assertEqual(self.take(slow), 0)
+
+        fast = self.connect()
+        self.assertEqual(self.take(fast), 0)
+        self.finish(fast, 0)
+        result = self.result()
+
+        # The slow worker finishing after run() returned changes nothing
+        slow.send(("result", 0, [{"crib": b"late", "start": 0}], {b"late"}))
+        self.assertEqual(slow.recv(), ("ack",))
+        self.assertEqual(result, (match(0), {b"word0"}, frozenset()))
+        self.assertEqual(self.coordinator.matches, match(0))
+
+    def test_first_result_wins(self):
+        self.start(make_leases(2), lease_timeout=0.3)
+        slow, other = self.connect(), self.connect()
+        self.assertEqual(self.take(slow), 0)
+        self.assertEqual(self.take(other), 1)
+
+        retry = self.connect()
+        self.assertEqual(self.take(retry), 0)
+        slow.send(("result", 0, match(0), {b"word0"}))
+        self.assertEqual(slow.recv(), ("ack",))
+        retry.send(("result", 0, [{"crib": b"again", "start": 0}], {b"again"}))
+        self.assertEqual(retry.recv(), ("ack",))
+        self.finish(other, 1)
+
+        matches, cribs, failed = self.result()
+        self.assertEqual(sorted(m["crib"] for m in matches),
+                         [b"word0", b"word1"])
+        self.assertEqual(cribs, {b"word0", b"word1"})
+        self.assertEqual(failed, frozenset())
+
+    def test_max_attempts(self):
+        self.start(make_leases(2), lease_timeout=0.3, max_attempts=2)
+        conn = self.connect()
+        self.finish(conn, self.take(conn))
+
+        # Lease 1 raises once and then times out, so it is given up on
+        self.assertEqual(self.take(conn), 1)
+        conn.send(("error", 1, "ValueError('bad lease')"))
+        self.assertEqual(conn.recv(), ("ack",))
+        self.assertEqual(self.take(conn), 1)
+
+        matches, _, failed = self.result()
+        self.assertEqual(matches, match(0))
+        self.assertEqual(failed, frozenset({1}))
+        self.assertEqual(self.coordinator.completed, {0})
+
+    def test_silent_peer_does_not_block(self):
+        self.start(make_leases(1))
+        silent = socket.create_connection(("127.0.0.1", self.port))
+        self.addCleanup(silent.close)
+
+        conn = self.connect()
+        self.finish(conn, self.take(conn))
+        self.assertEqual(self.result()[2], frozenset())
+
+    def test_wrong_authkey(self):
+        self.start(make_leases(1))
+        with self.assertRaises(distributed.AuthenticationError):
+            Client(("127.0.0.1", self.port), authkey=b"wrong")
+
+        conn = self.connect()
+        self.finish(conn, self.take(conn))
+        self.assertEqual(self.result()[0], match(0))
+
+
+class RunWorkerTest(unittest.TestCase):
+
+    def test_workers_merge_results(self):
+        leases = distributed.build_leases(
+            [{"alpha", "beta", "gamma", "delta", "omega"}], ["10"], 10, 2, 4)
+        coordinator = distributed.Coordinator(
+            ("127.0.0.1", 0), AUTHKEY, leases, ({}, 10, 2))
+        port = coordinator.listener.getsockname()[1]
+
+        def fake_crib_drag(words, xor_data, len_ct, num_ct, dict, offsets):
+            matches = [{"crib": word.encode("utf-8"), "start": offset}
+                       for word in words for offset in range(*offsets)]
+            return matches, {word.encode("utf-8") for word in words}
+
+        with mock.patch.object(distributed, "auto_crib_drag", fake_crib_drag), \
+                mock.patch.object(distributed, "construct_dict",
+                                  return_value=[set()]):
+            workers = [threading.Thread(target=distributed.run_worker,
+                                        args=("127.0.0.1", port, AUTHKEY))
+                       for _ in range(3)]
+            for worker in workers:
+                worker.start()
+            matches, cribs, failed = coordinator.run()
+            for worker in workers:
+                worker.join(timeout=10)
+
+        expected, expected_cribs = fake_crib_drag(
+            sorted({"alpha", "beta", "gamma", "delta", "omega"}),
+            {}, 10, 2, set(), (0, 10))
+        key = lambda m: (m["crib"], m["start"])
+        self.assertEqual(sorted(matches, key=key), sorted(expected, key=key))
+        self.assertEqual(cribs, expected_cribs)
+        self.assertEqual(failed, frozenset())
+        self.assertFalse(any(worker.is_alive() for worker in workers))
+
+
+if __name__ == "__main__":
+    unittest.main()
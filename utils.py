@@ -40,6 +40,26 @@ def load_words(file_path, previous_words=[]):
     return words
 
 
+def construct_dict():
+    """
+    Loads the SCOWL word lists from most to least common. Each tier only
+    keeps the words not already in a more common tier, and the last set
+    is the union of every tier.
+    """
+    words = []
+
+    word_path = 'dictionary/english-words'
+    words.append(load_words(f'{word_path}.10', words))
+    words.append(load_words(f'{word_path}.20', words))
+    words.append(load_words(f'{word_path}.35', words))
+    words.append(load_words(f'{word_path}.50', words))
+    words.append(load_words(f'{word_path}.70', words))
+    words.append(load_words(f'{word_path}.95', words))
+    words.append(set().union(*words))
+
+    return words
+
+
 def read_ciphertexts(filename):
     """
     Reads lines from 'filename', each line is assumed to be hex-encoded or binary-encoded ciphertext.
@@ -4,16 +4,27 @@ import subprocess
 from pprint import pprint
 import string
 
-process = subprocess.Popen(
-    "WordTrie/WordTrie.exe",
-    stdin=subprocess.PIPE,
-    stdout=subprocess.PIPE,
-    stderr=subprocess.PIPE,
-    text=True
-)
+process = None
 
-# Read and discard the startup message
-process.stdout.readline()
+
+def get_process():
+    """
+    Starts the C++ WordTrie process the first time it is needed, so that
+    importing this module does not require the binary.
+    """
+    global process
+    if process is None:
+        process = subprocess.Popen(
+            "WordTrie/WordTrie.exe",
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+
+        # Read and discard the startup message
+        process.stdout.readline()
+    return process
 
 
 BOUNDARY = bytes(string.whitespace + string.punctuation, "utf-8")
@@ -36,6 +47,7 @@ def send_command(command, type_, string):
         "type": type_,
         "string": string
     })
+    process = get_process()
     process.stdin.write(input_data + "\n")
     process.stdin.flush()
 